@@ -8,6 +8,7 @@
 # Dependencies:
 #               maya.cmds
 #               maya.api.OpenMaya
+#               numpy
 #
 #
 # Author: Eric Hug
@@ -18,18 +19,39 @@
 # IMPORT
 # built-in python libraries
 import os
+import atexit
+import sys
 import json
 import logging
+import contextlib
+import multiprocessing
+import concurrent.futures
 from importlib import reload
 
 # 3rd-party
 from maya import cmds
 from maya.api import OpenMaya as om2
+import numpy as np
 
 
 #==================================================================================================#
 # VARIABLES
 LOG = logging.getLogger(__name__)
+# mirror tables from _mirror_map, keyed by (topology key, source seed verts, destination seed verts)
+_MIRROR_MAPS = {}
+# (shape handle, indptr, indices) vertex adjacency from _build_topology_cache, keyed by _adjacency_key
+_ADJACENCY = {}
+# number of nested suspended_eval blocks currently open
+_SUSPEND_DEPTH = 0
+# reusable numpy buffers from _scratch, keyed by (purpose, shape, dtype)
+_SCRATCH = {}
+# obj layout written by _write_obj, matching OBJexport's "groups=1;ptgroups=1;materials=0;smoothing=1;normals=1;"
+_OBJ_HEADER  = "# This file uses centimeters as units for non-parametric coordinates.\n\ng default\n"
+_OBJ_FORMATS = {"v"  : "v %.6f %.6f %.6f",
+                "vt" : "vt %.6f %.6f",
+                "vn" : "vn %.6f %.6f %.6f",
+                "g"  : "s 1\ng {}\n",
+                "f"  : "f {}\n"}
 
 
 #==================================================================================================#
@@ -39,18 +61,18 @@ def import_src_mesh(file_path=""):
         Parameters:
                     file_path: full file path of the specified mesh
     '''
-    mesh_name = ""
-    nodes = cmds.file(file_path, 
-                      i=True, 
+    nodes = cmds.file(file_path,
+                      i=True,
                       force=True,
-                      groupReference=False, 
+                      groupReference=False,
                       mergeNamespacesOnClash=True,
                       removeDuplicateNetworks=True,
                       returnNewNodes=True)
-    for each in nodes:
-        if cmds.nodeType(each) == "transform":
-            mesh_name = each
-            break
+    # ls with no nodes lists the whole scene, so bail out before it when nothing was imported
+    if not nodes:
+        return ""
+    # let ls filter the new nodes in one call rather than querying each node's type
+    mesh_name = (cmds.ls(nodes, type="transform", long=False) or [""])[0]
 
     return mesh_name
 
@@ -61,43 +83,25 @@ def src_verts(central_vert="", mirror_axis="x"):
                     central_vert: a single vertex Number of the original blendshape mesh that lies along the middle of the mesh.
                     mirror_axis : axis a duplicated mesh is intended to be mirrored across
     '''
-    mesh = central_vert.split(".")[0]
-    shape = cmds.listRelatives(mesh, shapes=True)[0]
-    vert_num = central_vert.split(".")[-1]
-    vert_num = vert_num.split("[")[-1]
-    vert_num = int(vert_num.split("]")[0])
+    # Resolve the mesh and vertex number straight from the component name,
+    # instead of string-splitting it and looking up the shape with listRelatives
     sel = om2.MSelectionList()
-    sel.add(shape)
-    mob = sel.getDependNode(0)
-    mesh_verts = om2.MItMeshVertex(mob)
-    mesh_verts.setIndex(vert_num)
-    vert_ids = mesh_verts.getConnectedVertices()
-    vert_positions = []
-
-    # Get positions for each vertex connected to central_vert
-    for each in vert_ids:
-        full_name = central_vert.replace(str(vert_num), str(each))
-        pos = cmds.xform(full_name, query=True, translation=True, worldSpace=True)
-        vert_positions.append(pos)
+    sel.add(central_vert)
+    dag, component = sel.getComponent(0)
+    vert_num = om2.MFnSingleIndexedComponent(component).element(0)
+    # Look the neighbours up in the cached adjacency, instead of setting up a vertex iterator per query,
+    # then fetch only the neighbours' points rather than copying every point of the mesh
+    # (world space needs the function set built from a dag path, not a depend node)
+    mfn = om2.MFnMesh(dag)
+    indptr, indices = _build_topology_cache(mfn)
+    vert_ids = indices[indptr[vert_num]:indptr[vert_num + 1]].tolist()
+    vert_positions = np.array([mfn.getPoint(each, om2.MSpace.kWorld) for each in vert_ids])[:, :3]
 
     # Look for the highest vert in the y-axis, 
     # and the highest and lowest verts along the x-axis (for matching vertex orders later)
-    up_check = vert_positions[0][1]
-    up_vert = vert_ids[0]
-    side_check_hi = vert_positions[0][0]
-    side_check_lo = vert_positions[0][0]
-    side_vert_src = 0
-    side_vert_dest = 0
-    for num in range(len(vert_ids)):
-        if vert_positions[num][1] > up_check:
-            up_check = vert_positions[num][1]
-            up_vert = vert_ids[num]
-        if vert_positions[num][0] > side_check_hi:
-            side_check_hi = vert_positions[num][0]
-            side_vert_src = vert_ids[num]
-        elif vert_positions[num][0] < side_check_lo:
-            side_check_lo  = vert_positions[num][0]
-            side_vert_dest = vert_ids[num]
+    up_vert        = vert_ids[int(vert_positions[:, 1].argmax())]
+    side_vert_src  = vert_ids[int(vert_positions[:, 0].argmax())]
+    side_vert_dest = vert_ids[int(vert_positions[:, 0].argmin())]
     # Desired Values
     src_verts  = [vert_num, up_vert, side_vert_src]
     dest_verts = [vert_num, up_vert, side_vert_dest]
@@ -112,50 +116,541 @@ def transfer_vert_order(src_mesh="", dest_mesh="", vertex_ids=[[],[]]):
                     dest_mesh  : new_mesh
                     vertex_ids : vertex numbers from original and new mesh
     '''
-    src_verts =  ["{}.vtx[{}]".format(src_mesh,  each) for each in vertex_ids[0]]
-    dest_verts = ["{}.vtx[{}]".format(dest_mesh, each) for each in vertex_ids[1]]
-    cmds.meshRemap(src_verts[0]  , src_verts[1]  , src_verts[2], 
-                   dest_verts[0] , dest_verts[1] , dest_verts[2])
-    cmds.select(dest_mesh, replace=True)
-    cmds.polyNormalPerVertex(freezeNormal=False)
-    cmds.select(deselect=True)
-    cmds.delete(dest_mesh, 
-                constructionHistory=True)
+    with suspended_eval():
+        # The mirrored mesh is a duplicate, so its vertex ids line up with the source's.
+        # Walk the source topology from the seed vertices to find each vertex's mirror partner,
+        # then give the destination the source's face order and the partners' points.
+        src_fn  = _mesh_fn(src_mesh)
+        dest_fn = _mesh_fn(dest_mesh)
+        counts, connects = src_fn.getVertices()
+        mirror_map = _cached_mirror_map(src_fn.numVertices, counts, connects, vertex_ids)
+        points = _get_points(dest_fn, om2.MSpace.kObject)[mirror_map]
+        dest_counts, dest_connects = dest_fn.getVertices()
+        if np.array_equal(counts, dest_counts) and np.array_equal(connects, dest_connects):
+            # the destination already has the source's face order (create_mirrored_mesh with reverse_winding=False),
+            # so moving the points is enough and the rest of its mesh data is kept.
+            # That includes locked normals copied from the source, which no longer fit the mirrored points.
+            _set_points(dest_fn, points)
+            dest_fn.unlockVertexNormals(om2.MIntArray(range(dest_fn.numVertices)))
+        else:
+            uv_counts, uv_ids  = src_fn.getAssignedUVs()
+            u_values, v_values = src_fn.getUVs()
+            # the destination takes the source's connectivity, so the source's edge smoothing applies as is
+            _rebuild_mesh(dest_fn, points, counts, connects, 
+                          [u_values, v_values, uv_counts, uv_ids], _edge_smoothing(src_fn))
+        # the rebuild is done through the API, so there is usually no history left to bake
+        if _has_history(dest_fn):
+            cmds.delete(dest_mesh, 
+                        constructionHistory=True)
     
 
-def create_mirrored_mesh(mesh="", mirror_axis="x"):
+def create_mirrored_mesh(mesh="", mirror_axis="x", reverse_winding=True):
     ''' Duplicates and flips mesh across x-axis
         Parameters:
-                    mesh        : mesh user wants to mirror.
-                    mirror_axis : axis to mirror duplicated mesh across.
+                    mesh            : mesh user wants to mirror.
+                    mirror_axis     : axis to mirror duplicated mesh across.
+                    reverse_winding : when False, the faces are left inside out. Use this when transfer_vert_order follows,
+                                      since it gives the mesh the source's face order anyway.
     '''
-    new_name = ""
-    if "_l_" in mesh:
-        new_name = mesh.replace("_l_", "_r_")
-    else:
-        new_name = mesh.replace("_r_", "_l_")
-
-    cmds.duplicate(mesh, name=new_name)
-    cmds.setAttr("{}.s{}".format(new_name, mirror_axis), -1)
-    cmds.makeIdentity(new_name, 
-                      apply           = True, 
-                      scale           = True,
-                      normal          = 0,
-                      preserveNormals = True)
+    with suspended_eval():
+        new_name = cmds.duplicate(mesh, name=mirrored_name(mesh))[0]
+        # Flip the points directly rather than freezing a negative scale with makeIdentity,
+        # then reverse the face winding so the normals still point outward
+        mfn = _mesh_fn(new_name)
+        pts = _get_points(mfn, om2.MSpace.kObject)
+        pts[:, "xyz".index(mirror_axis)] *= -1
+        if reverse_winding:
+            _reverse_winding(mfn, pts)
+        else:
+            _set_points(mfn, pts)
 
     return new_name
 
 
 def export_dest_mesh(mesh="", file_path=""):
     '''Exports mirrored blendshape mesh to specified file path'''
-    cmds.select(mesh, replace=True)
-    print(file_path)
-    cmds.file(file_path, 
-              type                = "OBJexport",
-              force               = True,
-              exportSelected      = True,
-              preserveReferences  = True,
-              constructionHistory = False,
-              options = "groups=1;ptgroups=1;materials=0;smoothing=1;normals=1;")
-    cmds.select(deselect=True)
+    if not file_path:
+        LOG.error("No file path given for exporting {}.".format(mesh))
+        return
+    LOG.debug("Exporting %s", file_path)
+    # Pull the mesh data through the API and write the obj directly, 
+    # rather than going through the OBJexport translator and the selection
+    mfn = _mesh_fn(mesh)
+    counts, connects    = mfn.getVertices()
+    uv_counts, uv_ids   = mfn.getAssignedUVs()
+    u_values, v_values  = mfn.getUVs()
+    normal_counts, normal_ids = mfn.getNormalIds()
+    _write_obj(file_path = file_path,
+               name      = mesh.split("|")[-1],
+               points    = _get_points(mfn, om2.MSpace.kWorld),
+               counts    = counts,
+               connects  = connects,
+               uvs       = [np.column_stack([u_values, v_values]), uv_counts, uv_ids],
+               normals   = [np.array(mfn.getNormals(om2.MSpace.kWorld)), normal_ids])
+
+
+def mirror_and_export(src_mesh="", central_vert="", mirror_axis="x", out_path=""):
+    '''Mirrors a blendshape and writes it straight to an obj file, without creating a mirrored mesh in the scene.
+       Reads the source mesh once and does the rest on numpy arrays. The output differs from
+       create_mirrored_mesh + transfer_vert_order + export_dest_mesh in two ways:
+           1. points are reflected in world space, not object space, so they only match when src_mesh 
+              has no transform (as with meshes brought in by import_src_mesh).
+           2. normals are the averaged per-vertex normals (getVertexNormals), written once per face-vertex,
+              so hard edges are exported as smooth.
+        Parameters:
+                    src_mesh     : mesh user wants to mirror.
+                    central_vert : a single vertex of src_mesh that lies along the middle of the mesh (see src_verts).
+                    mirror_axis  : axis to mirror the blendshape across.
+                    out_path     : full file path of the exported obj.
+    '''
+    if not out_path:
+        LOG.error("No file path given for exporting {}.".format(src_mesh))
+        return
+    LOG.debug("Exporting %s", out_path)
+    axis = "xyz".index(mirror_axis)
+    src_fn = _mesh_fn(src_mesh)
+    counts, connects   = src_fn.getVertices()
+    uv_counts, uv_ids  = src_fn.getAssignedUVs()
+    u_values, v_values = src_fn.getUVs()
+    mirror_map = _cached_mirror_map(src_fn.numVertices, counts, connects, src_verts(central_vert, mirror_axis))
+    # reflect every point and per-vertex normal, then pull each vertex's values from its mirror partner
+    points  = _get_points(src_fn, om2.MSpace.kWorld)
+    normals = np.array(src_fn.getVertexNormals(False, om2.MSpace.kWorld))
+    points[:, axis]  *= -1
+    normals[:, axis] *= -1
+    # gather into buffers kept between calls, since every blendshape of a mesh has the same vertex count
+    mirrored_points  = np.take(points,  mirror_map, axis=0, out=_scratch("points",  points.shape))
+    mirrored_normals = np.take(normals, mirror_map, axis=0, out=_scratch("normals", normals.shape, normals.dtype))
+    _write_obj(file_path = out_path,
+               name      = mirrored_name(src_mesh.split("|")[-1]),
+               points    = mirrored_points,
+               counts    = counts,
+               connects  = connects,
+               uvs       = [np.column_stack([u_values, v_values]), uv_counts, uv_ids],
+               normals   = [mirrored_normals, connects])
+
+
+def mirror_many(src_files=[], out_dir="", vert_num=0, mirror_axis="x", workers=None):
+    '''Mirrors a batch of blendshape obj files in parallel, each in its own mayapy process, 
+       and returns the paths of the written files.
+       Every worker imports one file into an empty scene, runs mirror_and_export on it, then moves on to the next.
+       Files whose mirrored name matches their own (no side token) are skipped when out_dir holds the originals,
+       rather than being overwritten.
+        Parameters:
+                    src_files   : full file paths of the blendshape obj files (all sharing one topology)
+                    out_dir     : directory the mirrored obj files are written to
+                    vert_num    : number of a vertex along the middle of the mesh, not moved by any of the blendshapes
+                    mirror_axis : axis to mirror the blendshapes across
+                    workers     : number of mayapy processes to run. Defaults to the number of cpu cores.
+    '''
+    # spawn fresh mayapy interpreters; inside Maya, sys.executable is the Maya application itself
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(_mayapy_path())
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers or os.cpu_count(),
+                                                mp_context  = context,
+                                                initializer = _init_worker) as pool:
+        jobs = [pool.submit(_mirror_file, each, out_dir, vert_num, mirror_axis) for each in src_files]
+
+        # files that would have been written over themselves are skipped by _mirror_file
+        return [each.result() for each in jobs if each.result()]
+
+
+@contextlib.contextmanager
+def suspended_eval():
+    '''Suspends viewport refreshes, parallel evaluation and undo recording for the duration of the block,
+       so each duplicate/rebuild/delete does not trigger its own redraw and evaluation graph update.
+       Blocks can be nested; only the outermost one suspends and restores, 
+       so a caller running several core functions in a row can wrap them all once.
+    '''
+    global _SUSPEND_DEPTH
+    if _SUSPEND_DEPTH:
+        _SUSPEND_DEPTH += 1
+        try:
+            yield
+        finally:
+            _SUSPEND_DEPTH -= 1
+        return
+    eval_mode = cmds.evaluationManager(query=True, mode=True)[0]
+    if eval_mode != "off":
+        cmds.evaluationManager(mode="off")
+    cmds.refresh(suspend=True)
+    _SUSPEND_DEPTH = 1
+    try:
+        with _no_undo():
+            yield
+    finally:
+        _SUSPEND_DEPTH = 0
+        cmds.refresh(suspend=False)
+        if eval_mode != "off":
+            cmds.evaluationManager(mode=eval_mode)
+
+
+def mirrored_name(mesh=""):
+    '''Returns the name of the opposite side blendshape, swapping "_l_" and "_r_"'''
+    if "_l_" in mesh:
+        return mesh.replace("_l_", "_r_")
+
+    return mesh.replace("_r_", "_l_")
+
+
+def _mayapy_path():
+    '''Returns the path of the mayapy interpreter that belongs to the running Maya'''
+    mayapy = "mayapy.exe" if sys.platform == "win32" else "mayapy"
+
+    return os.path.join(os.environ["MAYA_LOCATION"], "bin", mayapy)
+
+
+def _init_worker():
+    '''Starts Maya inside a mirror_many worker process'''
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+    # shut Maya down cleanly when the pool retires the worker, instead of leaving it to interpreter teardown
+    atexit.register(maya.standalone.uninitialize)
+
+
+def _mirror_file(file_path="", out_dir="", vert_num=0, mirror_axis="x"):
+    '''Imports one blendshape obj into an empty scene and writes its mirrored version (mirror_many's per-file job).
+       Returns the written file's path, or None when the file was skipped.
+    '''
+    mesh_name = os.path.splitext(os.path.basename(file_path))[0]
+    out_path  = os.path.join(out_dir, mirrored_name(mesh_name))
+    # names without a side token mirror onto themselves, which would overwrite the source when out_dir is its folder
+    if os.path.normcase(os.path.abspath(f"{out_path}.obj")) == os.path.normcase(os.path.abspath(file_path)):
+        LOG.warning("Skipping {}: its mirrored file would overwrite it.".format(file_path))
+        return None
+    cmds.file(newFile=True, force=True)
+    mesh = import_src_mesh(file_path=file_path)
+    if mesh != mesh_name:
+        mesh = cmds.rename(mesh, mesh_name)
+    mirror_and_export(src_mesh     = mesh,
+                      central_vert = f"{mesh}.vtx[{vert_num}]",
+                      mirror_axis  = mirror_axis,
+                      out_path     = out_path)
+
+    return f"{out_path}.obj"
+
+
+def _cached_mirror_map(num_verts, counts, connects, vertex_ids=[[],[]]):
+    '''Returns _mirror_map's table for the given topology and seed vertices, only walking the mesh 
+       the first time a topology/seed combination is seen (blendshapes of one mesh all share it).
+    '''
+    cache_key = (_topology_key(counts, connects), tuple(vertex_ids[0]), tuple(vertex_ids[1]))
+    if cache_key not in _MIRROR_MAPS:
+        _MIRROR_MAPS[cache_key] = _mirror_map(num_verts, counts, connects, vertex_ids[0], vertex_ids[1])
+
+    return _MIRROR_MAPS[cache_key]
+
+
+def _scratch(purpose="", shape=(0,), dtype=np.float64):
+    '''Returns a module-level numpy buffer for the given purpose and shape, only allocating it the first time.
+       The contents are overwritten by the next caller, so only use it for data consumed within one call.
+    '''
+    key = (purpose, tuple(shape), np.dtype(dtype))
+    if key not in _SCRATCH:
+        _SCRATCH[key] = np.empty(shape, dtype=dtype)
+
+    return _SCRATCH[key]
+
+
+def _write_obj(file_path="", name="", points=None, counts=[], connects=[], uvs=None, normals=None):
+    '''Writes a single polygon mesh to an obj file, matching the layout of Maya's OBJexport (see _OBJ_FORMATS)
+        Parameters:
+                    file_path : output path. ".obj" is appended if missing, like cmds.file does.
+                    name      : group name written for the mesh
+                    points    : (numVertices, 3) numpy array of positions
+                    counts    : number of vertices in each face
+                    connects  : vertex ids of each face, face after face
+                    uvs       : [(numUVs, 2) numpy array, uv counts per face, uv ids per face-vertex] or None
+                    normals   : [(numNormals, 3) numpy array, normal ids per face-vertex] or None
+    '''
+    if not file_path.lower().endswith(".obj"):
+        file_path = "{}.obj".format(file_path)
+    counts   = np.asarray(counts, dtype=np.int64)
+    ends     = np.cumsum(counts).tolist()
+    starts   = [0] + ends[:-1]
+    has_uvs     = uvs is not None and len(uvs[0]) > 0
+    has_normals = normals is not None and len(normals[0]) > 0
+    # build each face-vertex's "v/vt/vn" token; obj indices start at 1
+    v_tokens  = (np.asarray(connects, dtype=np.int64) + 1).astype(str)
+    vt_tokens = np.full(len(v_tokens), "", dtype=object)
+    if has_uvs:
+        # faces without uvs have no entries in the uv id array
+        vt_tokens[np.repeat(np.asarray(uvs[1]) > 0, counts)] = (np.asarray(uvs[2], dtype=np.int64) + 1).astype(str)
+    if has_normals:
+        vn_tokens = (np.asarray(normals[1], dtype=np.int64) + 1).astype(str)
+        tokens = [f"{v}/{vt}/{vn}" for v, vt, vn in zip(v_tokens, vt_tokens, vn_tokens)]
+    else:
+        tokens = [f"{v}/{vt}" if vt else v for v, vt in zip(v_tokens, vt_tokens)]
+
+    with open(file_path, "w") as obj_file:
+        obj_file.write(_OBJ_HEADER)
+        np.savetxt(obj_file, points, fmt=_OBJ_FORMATS["v"])
+        if has_uvs:
+            np.savetxt(obj_file, uvs[0], fmt=_OBJ_FORMATS["vt"])
+        if has_normals:
+            np.savetxt(obj_file, normals[0], fmt=_OBJ_FORMATS["vn"])
+        obj_file.write(_OBJ_FORMATS["g"].format(name))
+        obj_file.writelines(_OBJ_FORMATS["f"].format(" ".join(tokens[start:end])) for start, end in zip(starts, ends))
+
+
+def _mesh_fn(mesh=""):
+    '''Returns an MFnMesh for the given mesh, built from its dag path so world space queries work'''
+    sel = om2.MSelectionList()
+    sel.add(mesh)
+
+    return om2.MFnMesh(sel.getDagPath(0))
+
+
+def _get_points(mfn, space=om2.MSpace.kObject):
+    '''Returns the mesh's vertex positions as a (numVertices, 3) numpy array'''
+    return np.array(mfn.getPoints(space))[:, :3]
+
+
+def _set_points(mfn, points, space=om2.MSpace.kObject):
+    '''Sets the mesh's vertex positions from a (numVertices, 3) numpy array'''
+    mfn.setPoints(om2.MPointArray(points.tolist()), space)
+    mfn.updateSurface()
+
+
+def _reversed_face_order(counts):
+    '''Returns the indices that reverse every face's run in a face-vertex array (e.g. from MFnMesh.getVertices)
+        Parameters:
+                    counts: number of face-vertices in each face
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    ends   = np.cumsum(counts)
+    starts = ends - counts
+    # each face-vertex at index i in the run [start, end) swaps with (start + end - 1 - i)
+    return np.repeat(starts + ends - 1, counts) - np.arange(counts.sum())
+
+
+def _reverse_winding(mfn, points):
+    '''Rebuilds a mesh in place with new points and each face's vertex order reversed, 
+       carrying the current uv set and edge smoothing across. Avoids the per-vertex normal rebuild done by makeIdentity/polyNormal.
+       The rest of the mesh data is dropped (see _rebuild_mesh).
+        Parameters:
+                    mfn    : MFnMesh of the mesh being flipped
+                    points : (numVertices, 3) numpy array of the new object space positions
+    '''
+    counts, connects   = mfn.getVertices()
+    uv_counts, uv_ids  = mfn.getAssignedUVs()
+    u_values, v_values = mfn.getUVs()
+    connects = np.asarray(connects)[_reversed_face_order(counts)]
+    uv_ids   = np.asarray(uv_ids)[_reversed_face_order(uv_counts)]
+    _rebuild_mesh(mfn, points, counts, connects, 
+                  [u_values, v_values, uv_counts, uv_ids], _edge_smoothing(mfn))
+
+
+def _rebuild_mesh(mfn, points, counts, connects, uvs=None, edge_smoothing=None):
+    '''Replaces a mesh's geometry in place.
+       Only points, connectivity, the current uv set and edge smoothing survive: createInPlace drops
+       other uv sets, color sets, per-face shading assignments, creases and locked normals.
+        Parameters:
+                    mfn            : MFnMesh of the mesh being rebuilt
+                    points         : (numVertices, 3) numpy array of object space positions
+                    counts         : number of vertices in each face
+                    connects       : vertex ids of each face, face after face
+                    uvs            : [u values, v values, uv counts per face, uv ids per face-vertex] for the current uv set
+                    edge_smoothing : (edge keys, smooth flags) from _edge_smoothing. Edges not found are left hard.
+    '''
+    # the shape's cached adjacency no longer applies once its connectivity is replaced
+    _ADJACENCY.pop(_adjacency_key(mfn), None)
+    mfn.createInPlace(om2.MPointArray(points.tolist()), 
+                      om2.MIntArray(counts), 
+                      om2.MIntArray(np.asarray(connects).tolist()))
+    if uvs and len(uvs[0]):
+        mfn.setUVs(uvs[0], uvs[1])
+        mfn.assignUVs(om2.MIntArray(uvs[2]), om2.MIntArray(np.asarray(uvs[3]).tolist()))
+    if edge_smoothing:
+        # a rebuilt mesh comes back with every edge hard, so only the smooth edges need setting
+        keys, smooths = edge_smoothing
+        if keys is None:
+            smooth_ids = np.arange(mfn.numEdges) if smooths else np.empty(0, dtype=np.int64)
+        else:
+            # match edges by their vertices, so it works whatever the new edge ids are
+            new_keys   = _edge_keys(mfn)
+            found      = np.searchsorted(keys, new_keys).clip(max=len(keys) - 1)
+            smooth_ids = np.flatnonzero((keys[found] == new_keys) & smooths[found])
+        if len(smooth_ids):
+            mfn.setEdgeSmoothings(om2.MIntArray(smooth_ids.tolist()), [True] * len(smooth_ids))
+            mfn.cleanupEdgeSmoothing()
+    mfn.updateSurface()
+
+
+def _edge_smoothing(mfn):
+    '''Returns the mesh's edge smoothing as (edge keys, smooth flags), for handing to _rebuild_mesh.
+       When every edge shares one setting the keys are None and the flag is a single bool, 
+       so the edge vertices are only read for meshes that mix hard and smooth edges.
+    '''
+    num_edges = mfn.numEdges
+    smooths = np.fromiter((mfn.isEdgeSmooth(each) for each in range(num_edges)), dtype=bool, count=num_edges)
+    if smooths.all() or not smooths.any():
+        return None, bool(smooths.any())
+    keys  = _edge_keys(mfn)
+    order = np.argsort(keys)
+
+    return keys[order], smooths[order]
+
+
+def _edge_keys(mfn):
+    '''Returns every edge's vertex pair packed into an int64 key (see _pack_edges), lower vertex in the high bits'''
+    pairs = np.array([mfn.getEdgeVertices(each) for each in range(mfn.numEdges)], dtype=np.int64).reshape(-1, 2)
+    return _pack_edges(pairs.min(axis=1), pairs.max(axis=1))
+
+
+def _face_vertex_links(counts):
+    '''Returns the index of the next and previous face-vertex within the same face, for every face-vertex
+        Parameters:
+                    counts: number of face-vertices in each face
+    '''
+    counts  = np.asarray(counts, dtype=np.int64)
+    ends    = np.cumsum(counts)
+    starts  = ends - counts
+    filled  = counts > 0
+    next_fv = np.arange(counts.sum()) + 1
+    prev_fv = np.arange(counts.sum()) - 1
+    # wrap the last face-vertex of each face back to its first, and vice versa
+    next_fv[ends[filled] - 1] = starts[filled]
+    prev_fv[starts[filled]]   = ends[filled] - 1
+
+    return next_fv, prev_fv
+
+
+def _build_topology_cache(mfn):
+    '''Returns the mesh's vertex adjacency as flat arrays: (indptr, indices).
+       Vertex v's neighbours are indices[indptr[v]:indptr[v + 1]].
+       The adjacency only depends on topology, so it is built once per shape from MFnMesh.getVertices and reused.
+       Entries are looked up by shape and component counts rather than a hash of getVertices, so lookups stay cheap,
+       and each keeps the shape's MObjectHandle: an entry whose shape was deleted (or whose pointer Maya reused
+       for another shape) is rebuilt, and entries of deleted shapes are dropped whenever a new one is added.
+       _rebuild_mesh drops the entry of the shape it rebuilds.
+        Parameters:
+                    mfn: MFnMesh of the mesh
+    '''
+    key   = _adjacency_key(mfn)
+    entry = _ADJACENCY.get(key)
+    if entry is None or not entry[0].isValid() or entry[0].object() != mfn.object():
+        for each in [each for each, value in _ADJACENCY.items() if not value[0].isValid()]:
+            del _ADJACENCY[each]
+        counts, connects = mfn.getVertices()
+        num_verts = mfn.numVertices
+        connects  = np.asarray(connects, dtype=np.int64)
+        next_vert = connects[_face_vertex_links(counts)[0]]
+        # every face edge in both directions, packed with the vertex in the high bits so unique() sorts by vertex
+        edges   = np.unique(np.concatenate([_pack_edges(connects, next_vert), _pack_edges(next_vert, connects)]))
+        indptr  = np.zeros(num_verts + 1, dtype=np.int32)
+        indptr[1:] = np.cumsum(np.bincount(edges >> 32, minlength=num_verts))
+        entry = (om2.MObjectHandle(mfn.object()), indptr, (edges & 0xFFFFFFFF).astype(np.int32))
+        _ADJACENCY[key] = entry
+
+    return entry[1], entry[2]
+
+
+def _adjacency_key(mfn):
+    '''Returns the _ADJACENCY key of a mesh: its shape's handle hash and its vertex, edge and face-vertex counts'''
+    return (om2.MObjectHandle(mfn.object()).hashCode(), mfn.numVertices, mfn.numEdges, mfn.numFaceVertices)
+
+
+def _topology_key(counts, connects):
+    '''Returns a hashable key identifying a mesh's face-vertex layout (from MFnMesh.getVertices)'''
+    return hash((np.asarray(counts, dtype=np.int32).tobytes(), np.asarray(connects, dtype=np.int32).tobytes()))
+
+
+def _pack_edges(start_verts, end_verts):
+    '''Packs directed edges (start vert -> end vert) into single int64 keys, start vert in the high 32 bits'''
+    return (np.asarray(start_verts, dtype=np.int64) << 32) | np.asarray(end_verts, dtype=np.int64)
+
+
+def _find_edges(sorted_keys, key_order, keys):
+    '''Returns the face-vertex index of each packed edge key, or -1 where the edge does not exist
+        Parameters:
+                    sorted_keys : every half-edge key of the mesh, sorted
+                    key_order   : face-vertex index of each entry in sorted_keys (argsort of the unsorted keys)
+                    keys        : packed edge keys to look up
+    '''
+    found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+
+    return np.where(sorted_keys[found] == keys, key_order[found], -1)
+
+
+def _mirror_map(num_verts, counts, connects, src_ids=[], dest_ids=[]):
+    '''Returns a numpy array holding the mirror partner of every vertex, found by walking the mesh's faces
+       outward from the seed vertices. A mirror reverses winding, so half-edge a->b maps onto m(b)->m(a).
+        Parameters:
+                    num_verts: number of vertices in the mesh
+                    counts   : number of vertices in each face
+                    connects : vertex ids of each face, face after face
+                    src_ids  : [central vert, up vert, side vert] (from src_verts)
+                    dest_ids : [central vert, up vert, opposite side vert] (from src_verts)
+    '''
+    counts   = np.asarray(counts, dtype=np.int64)
+    connects = np.asarray(connects, dtype=np.int64)
+    face_of  = np.repeat(np.arange(len(counts)), counts)
+    next_fv, prev_fv = _face_vertex_links(counts)
+    next_vert = connects[next_fv]
+    # Pack each half-edge a->b into one int64 key, sort the keys once, and find every half-edge's
+    # twin (b->a) with a single vectorised binary search instead of a dict of tuples
+    keys       = _pack_edges(connects, next_vert)
+    key_order  = np.argsort(keys)
+    twin       = _find_edges(keys[key_order], key_order, _pack_edges(next_vert, connects))
+
+    # Seed: central vert stays put, the side vert swaps to its opposite; images are (m(b), m(a))
+    central, side_src, side_dest = src_ids[0], src_ids[2], dest_ids[2]
+    seed_keys = _pack_edges(np.array([central, side_dest, side_src, central]), 
+                            np.array([side_src, central, central, side_dest]))
+    seed = _find_edges(keys[key_order], key_order, seed_keys).tolist()
+    seed = seed[:2] if seed[0] >= 0 else seed[2:]
+    if min(seed) < 0:
+        raise RuntimeError("Seed vertices {} and {} do not share edges with the central vertex.".format(src_ids, dest_ids))
+
+    mirror_map = [-1] * num_verts
+    visited    = [False] * len(counts)
+    face_of    = face_of.tolist()
+    face_size  = counts.tolist()
+    connects   = connects.tolist()
+    next_vert  = next_vert.tolist()
+    next_fv    = next_fv.tolist()
+    prev_fv    = prev_fv.tolist()
+    twin       = twin.tolist()
+    pending = [tuple(seed)]
+    while pending:
+        fv, image = pending.pop()
+        if visited[face_of[fv]]:
+            continue
+        visited[face_of[fv]] = True
+        if face_size[face_of[fv]] != face_size[face_of[image]]:
+            raise RuntimeError("Mesh topology is not symmetrical around the seed vertices {}.".format(src_ids))
+        # step forward around the source face and backward around its image
+        for _ in range(face_size[face_of[fv]]):
+            mirror_map[connects[fv]] = next_vert[image]
+            if twin[fv] >= 0 and not visited[face_of[twin[fv]]]:
+                if twin[image] < 0:
+                    raise RuntimeError("Mesh topology is not symmetrical around the seed vertices {}.".format(src_ids))
+                pending.append((twin[fv], twin[image]))
+            fv, image = next_fv[fv], prev_fv[image]
+    mirror_map = np.array(mirror_map, dtype=np.int64)
+
+    if mirror_map[src_ids[1]] != dest_ids[1]:
+        LOG.warning("Up vertex {} did not map onto itself; check the central vertex lies on the mirror line.".format(src_ids[1]))
+    unmapped = mirror_map < 0
+    if unmapped.any():
+        LOG.warning("{} vertices are not connected to the central vertex and keep their order.".format(int(unmapped.sum())))
+        mirror_map[unmapped] = np.flatnonzero(unmapped)
+
+    return mirror_map
+
+
+def _has_history(mfn):
+    '''Returns whether the mesh shape has construction history feeding its inMesh'''
+    return om2.MFnDependencyNode(mfn.object()).findPlug("inMesh", False).isDestination
+
 
+@contextlib.contextmanager
+def _no_undo():
+    '''Turns off undo recording for the duration of the block, restoring the previous state afterward'''
+    undo_state = cmds.undoInfo(query=True, stateWithoutFlush=True)
+    cmds.undoInfo(stateWithoutFlush=False)
+    try:
+        yield
+    finally:
+        cmds.undoInfo(stateWithoutFlush=undo_state)
@@ -17,53 +17,69 @@
 # IMPORT
 # built-in python libraries
 import os
-import sys
 import logging
 from importlib import reload
 
 # 3rd-party
 from maya import cmds, OpenMayaUI
 from PySide2 import QtWidgets, QtCore, QtGui
-from shiboken2 import wrapInstance
+from shiboken2 import wrapInstance, isValid
 
 
 from blendshape_mirrorer import core
-reload(core)
+# only re-execute core on every launch while developing the tool
+if os.environ.get("BSM_DEV"):
+    reload(core)
 
 
 #==================================================================================================#
 # VARIABLES
 LOG = logging.getLogger(__name__)
+# wrapped Maya main window, reused between launches (see get_maya_main_window)
+_MAIN_WINDOW = None
+# Both stylesheets are applied once to the tool window; 
+# widgets opt in by setting their "textfieldState" property (see MirrorBlendShapeTool.set_textfield_state)
 TEXTFIELD_STYLESHEET_ACTIVE = '''
-QPushButton {
+*[textfieldState="active"] QPushButton {
     background: #555;
     color: lightgrey;
 }
 
-QPushButton:hover {
+*[textfieldState="active"] QPushButton:hover {
     color: white;
     background: #666;
 }
 '''
 TEXTFIELD_STYLESHEET_INACTIVE = '''
-QLabel {
+*[textfieldState="inactive"] QLabel {
     color:rgb(135,135,135);
 }
 
-QLineEdit {
+*[textfieldState="inactive"] QLineEdit {
     background: rgb(76,76,76); 
     color:rgb(135,135,135);
 }
 '''
 
+# BasicWidget options
+LAYOUT_TYPES = {"vertical"   : QtWidgets.QVBoxLayout,
+                "horizontal" : QtWidgets.QHBoxLayout,
+                "grid"       : QtWidgets.QGridLayout}
+H_ALIGNMENTS = {"left"   : QtCore.Qt.AlignLeft,
+                "center" : QtCore.Qt.AlignHCenter,
+                "right"  : QtCore.Qt.AlignRight}
+V_ALIGNMENTS = {"top"    : QtCore.Qt.AlignTop,
+                "center" : QtCore.Qt.AlignVCenter,
+                "bottom" : QtCore.Qt.AlignBottom}
+
 #==================================================================================================#
 # FUNCTIONS
 def start_up(width=720, height=258):
     '''Start Function for user to run the tool.'''
     win = get_maya_main_window()
-    for each in win.findChildren(QtWidgets.QWidget):
-        if each.objectName() == "MirrorBlendShapeTool":
-            each.deleteLater()
+    existing = win.findChild(QtWidgets.QWidget, "MirrorBlendShapeTool")
+    if existing is not None:
+        existing.deleteLater()
     tool = MirrorBlendShapeTool(parent=win)
     tool.resize(width, height)
     tool.show()
@@ -71,16 +87,16 @@ def start_up(width=720, height=258):
     return tool
 
 def get_maya_main_window():
-    '''Locates Main Window, so we can parent our tool to it.'''
-    maya_window_ptr = OpenMayaUI.MQtUtil.mainWindow()
+    '''Locates Main Window, so we can parent our tool to it.
+       The wrapper is cached for the session, and only rebuilt if Qt has deleted the window underneath it.
+    '''
+    global _MAIN_WINDOW
+    if _MAIN_WINDOW is None or not isValid(_MAIN_WINDOW):
+        maya_window_ptr = OpenMayaUI.MQtUtil.mainWindow()
+        _MAIN_WINDOW = wrapInstance(int(maya_window_ptr), QtWidgets.QWidget)
 
-    return wrapInstance(interpret_int_long(maya_window_ptr), QtWidgets.QWidget)
+    return _MAIN_WINDOW
 
-def interpret_int_long(value):
-    if int(sys.version.split(" ")[0][0]) > 2:
-        return int(value)
-    else:
-        return long(value)
 #==================================================================================================#
 # CLASSES
 class MirrorBlendShapeTool(QtWidgets.QWidget):
@@ -105,16 +121,11 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
         self.main_layout.setSpacing(6)
         self.main_layout.setContentsMargins(QtCore.QMargins(0, 0, 0, 0))
         self.setLayout(self.main_layout)
-        # Menu
+        # Menu (actions are added in build_deferred_ui)
         self.menu_bar = QtWidgets.QMenuBar()
         self.menu = QtWidgets.QMenu("File")
-        self.menu_actions = [QtWidgets.QAction("Import Mesh"), 
-                             QtWidgets.QAction("Export Selected Mesh")]
+        self.menu_actions = []
         self.menu_bar.addMenu(self.menu)
-        for each in self.menu_actions:
-            self.menu.addAction(each)
-        self.menu_actions[0].triggered.connect(self.import_mesh)
-        self.menu_actions[1].triggered.connect(self.export_mesh)
         self.components_widget   = BasicWidget(layout_type="vertical", 
                                                spacing=6, 
                                                margins=[6,0,6,6], 
@@ -141,7 +152,7 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
         self.vert_checker_widget.layout.addItem(self.spacer)
         self.vert_checker_widget.layout.addWidget(self.vert_textfield)
         self.vert_checker_widget.layout.addWidget(self.vert_btn)
-        self.vert_checker_widget.setStyleSheet(TEXTFIELD_STYLESHEET_ACTIVE)
+        self.vert_checker_widget.setProperty("textfieldState", "active")
         self.vert_textfield.setPlaceholderText("(Vertex along central edgeloop of Imported Mesh)")
         self.vert_btn.clicked.connect(self.get_vertex_number)
         # Vertex Checker Separator
@@ -185,7 +196,7 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
                                                 search_type="directory")
         self.export_dir_widget.browse_btn.setFixedWidth(124)
         self.export_dir_widget.setContentsMargins(QtCore.QMargins(12, 0, 0, 0))
-        self.export_dir_widget.setStyleSheet(TEXTFIELD_STYLESHEET_ACTIVE)
+        self.export_dir_widget.setProperty("textfieldState", "active")
         # Build Options Separator
         self.build_separator = QtWidgets.QFrame()
         self.build_separator.setLineWidth(1)
@@ -202,13 +213,11 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
         self.new_import_btn.clicked.connect(self.new_blendshape)
         self.final_btns_widget.layout.addWidget(self.new_import_btn)
         self.final_btns_widget.layout.addWidget(self.build_btn)
-        self.new_import_btn.setToolTip("Start a new mirrored blendshape after current one is built and exported.")
         # Assemble Components
         self.main_layout.addWidget(self.menu_bar)
         self.main_layout.addWidget(self.menu_separator)
         self.components_widget.layout.addWidget(self.vert_checker_widget)
         self.components_widget.layout.addWidget(self.vert_separator)
-        self.components_widget.layout.addWidget(self.mirror_axis_widget)
         self.components_widget.layout.addWidget(self.options_label)
         self.components_widget.layout.addWidget(self.mirror_axis_widget)
         self.components_widget.layout.addWidget(self.export_widget)
@@ -217,7 +226,19 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
         self.components_widget.layout.addWidget(self.final_btns_widget)
         self.main_layout.addWidget(self.components_widget)
         # Finalize
+        self.setStyleSheet(TEXTFIELD_STYLESHEET_ACTIVE + TEXTFIELD_STYLESHEET_INACTIVE)
         self.setWindowFlags(QtCore.Qt.Window)
+        # Build parts not needed for the first paint once the window is showing
+        QtCore.QTimer.singleShot(0, self.build_deferred_ui)
+
+    def build_deferred_ui(self):
+        '''Fills in the parts of the UI that aren't visible on the first paint: menu actions and tooltips.'''
+        self.menu_actions = [QtWidgets.QAction("Import Mesh"), 
+                             QtWidgets.QAction("Export Selected Mesh")]
+        self.menu.addActions(self.menu_actions)
+        self.menu_actions[0].triggered.connect(self.import_mesh)
+        self.menu_actions[1].triggered.connect(self.export_mesh)
+        self.new_import_btn.setToolTip("Start a new mirrored blendshape after current one is built and exported.")
 
     def build(self):
         '''Creates the mirrored blendshape. 
@@ -226,38 +247,42 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
                    (Ideally a vertex not modified by the blendshape that runs down the center of the mesh)
                 2. If export directory not specified, popup window will appear and ask user for one.
         '''
+        central_vert = None
         if self.vert_textfield.text() == "":
-            if cmds.ls(selection=True, flatten=True)[0]:
-                central_vert = cmds.ls(selection=True, flatten=True)[0]
-                mesh = central_vert.split(".")[0]
-            else: LOG.error("No single vertex specified in textfield, nor single vertex selected in scene.")
+            sel = cmds.ls(selection=True, flatten=True)
+            central_vert = sel[0] if sel else None
+            if not central_vert:
+                LOG.error("No single vertex specified in textfield, nor single vertex selected in scene.")
         elif cmds.objExists(self.vert_textfield.text()) == False:
             LOG.error("String in textfield is a vertex that does not exist. Check if there\'s quotes in textfield.")
         else:
             central_vert = self.vert_textfield.text()
-            mesh = central_vert.split(".")[0]
-
-        # duplicate mesh, flip mesh across x-axis, freeze scale transformation
-        new_mesh = core.create_mirrored_mesh(mesh=mesh)
-        # get vertices for transferring vertex order
-        needed_verts = core.src_verts(central_vert=central_vert)
-        # transfer vertex order
-        core.transfer_vert_order(src_mesh   = mesh, 
-                                 dest_mesh  = new_mesh, 
-                                 vertex_ids = needed_verts)
+        if not central_vert:
+            return
+        mesh = central_vert.split(".")[0]
+
+        # suspend refreshes and evaluation once for the whole build rather than once per step
+        with core.suspended_eval():
+            # duplicate mesh and flip mesh across x-axis (the winding is fixed by the vertex order transfer)
+            new_mesh = core.create_mirrored_mesh(mesh=mesh, reverse_winding=False)
+            # get vertices for transferring vertex order
+            needed_verts = core.src_verts(central_vert=central_vert)
+            # transfer vertex order
+            core.transfer_vert_order(src_mesh   = mesh, 
+                                     dest_mesh  = new_mesh, 
+                                     vertex_ids = needed_verts)
         # export new mesh as opposite side blendshape
         # if preview setting checked, do not export
         if self.export_cbox.isChecked():
             self.directory_path = self.export_dir_widget.file_path_line.text()
-            if os.path.isdir(self.directory_path):
-                full_path = "{}/{}".format(self.directory_path, new_mesh)
-                core.export_dest_mesh(mesh      = new_mesh, 
-                                      file_path = full_path)
-            else:
+            if not os.path.isdir(self.directory_path):
                 self.directory_path = self.browse_directory()
-                full_path = "{}/{}".format(self.directory_path, new_mesh)
-                core.export_dest_mesh(mesh      = new_mesh, 
-                                      file_path = full_path)
+            # an empty path means the directory dialog was cancelled
+            if not self.directory_path:
+                return
+            full_path = f"{self.directory_path}/{new_mesh}"
+            core.export_dest_mesh(mesh      = new_mesh, 
+                                  file_path = full_path)
 
     def get_vertex_number(self):
         '''Get central vertex for mirroring purposes'''
@@ -267,7 +292,10 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
     def import_mesh(self):
         '''Import blendshape mesh and frame in viewport'''
         # Get file path
-        file_path = self.browse_command().replace("\'", "")
+        file_path = self.browse_command()
+        # an empty path means the file dialog was cancelled
+        if not file_path:
+            return
         mesh_name = file_path.split("/")[-1].replace(".obj","")
         src_dir   = file_path.split(mesh_name)[0]
         if cmds.objExists(mesh_name):
@@ -280,9 +308,12 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
         self.directory_path = src_dir
         self.export_dir_widget.file_path_line.setText(src_dir)
         # frame mesh in viewport
-        curCamera="persp"
-        for vp in cmds.getPanel(type="modelPanel"):
-            curCamera=cmds.modelEditor(vp,q=1,av=1,cam=1)
+        # only query the viewport the user is working in
+        focus_panel = cmds.getPanel(withFocus=True)
+        if focus_panel and cmds.getPanel(typeOf=focus_panel) == "modelPanel":
+            curCamera = cmds.modelEditor(focus_panel, q=1, av=1, cam=1)
+        else:
+            curCamera = "persp"
         cmds.select(mesh_name, replace=True)
         cmds.viewFit(curCamera, fitFactor=1)
 
@@ -293,10 +324,10 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
                                                           dir="{}{}".format(self.directory_path, mesh),
                                                           caption="Save Blendshape Mesh",
                                                           filter="Object Files (*.obj);;" )
-        # get full file path data from tuple
-        new_string = list(file_path)[0]
-        new_string = new_string.replace("[", "").replace("]", "")
-        new_string = new_string.replace(".obj", "")
+        # get full file path data from (path, filter) tuple; an empty path means the dialog was cancelled
+        if not file_path[0]:
+            return
+        new_string = file_path[0].replace(".obj", "")
         # Call core export function
         core.export_dest_mesh(mesh=mesh, 
                               file_path=new_string)
@@ -307,12 +338,8 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
                                                               dir=self.directory_path,
                                                               caption="Get Blendshape Mesh",
                                                               filter="Object Files (*.obj);;" )
-        # get full file path data from tuple
-        new_string = list(self.sel_file)
-        new_string.pop(-1)
-        new_string = str(new_string).replace("[", "").replace("]", "")
-
-        return new_string
+        # get full file path data from (path, filter) tuple
+        return self.sel_file[0]
     
     def browse_directory(self):
         '''Choose Directory path if one does not exist in export-textfield'''
@@ -327,13 +354,22 @@ class MirrorBlendShapeTool(QtWidgets.QWidget):
             self.export_dir_widget.file_path_line.setReadOnly(False)
             self.export_dir_widget.file_path_line.setEnabled(True)
             self.export_dir_widget.browse_btn.setEnabled(True)
-            self.export_dir_widget.setStyleSheet(TEXTFIELD_STYLESHEET_ACTIVE)
+            self.set_textfield_state(self.export_dir_widget, active=True)
         else:
             self.export_dir_widget.file_path_line.setReadOnly(True)
             self.export_dir_widget.file_path_line.setEnabled(False)
             self.export_dir_widget.browse_btn.setEnabled(False)
-            self.export_dir_widget.setStyleSheet(TEXTFIELD_STYLESHEET_INACTIVE)
+            self.set_textfield_state(self.export_dir_widget, active=False)
     
+    def set_textfield_state(self, widget=None, active=True):
+        '''Switches a widget between the active and inactive textfield styles.
+           Only re-polishes the affected widgets instead of re-parsing a stylesheet.
+        '''
+        widget.setProperty("textfieldState", "active" if active else "inactive")
+        for each in [widget] + widget.findChildren(QtWidgets.QWidget):
+            each.style().unpolish(each)
+            each.style().polish(each)
+
     def new_blendshape(self):
         '''Creates a new scene and imports a new blendshape for the user to mirror'''
         cmds.file(newFile=True, force=True)
@@ -421,11 +457,9 @@ class BrowseWidget(QtWidgets.QWidget):
 
         # Return path to textfield
         if isinstance(self.sel_file, tuple):
-            # Use for 'file' or 'files'
-            new_string = list(self.sel_file)
-            new_string.pop(-1)
-            new_string = str(new_string).replace("[", "").replace("]", "")
-            self.file_path_line.setText(new_string)
+            # Use for 'file', 'saveFile' (path, filter) or 'files' ([paths], filter)
+            paths = self.sel_file[0]
+            self.file_path_line.setText(paths if isinstance(paths, str) else ", ".join(paths))
         elif isinstance(self.sel_file, str):
             # Use for 'directory'
             self.file_path_line.setText(self.sel_file)
@@ -498,35 +532,15 @@ class BasicWidget(QtWidgets.QWidget):
         self.margins = QtCore.QMargins(margins[0], margins[1], margins[2], margins[3])
 
         # Base Window
-        # # Layout Type
-        if self.layout_type == "vertical":
-            self.layout = QtWidgets.QVBoxLayout()
-        elif self.layout_type == "horizontal":
-            self.layout = QtWidgets.QHBoxLayout()
-        elif self.layout_type == "grid":
-            self.layout = QtWidgets.QGridLayout()
-        else:
-            LOG.error("Invalid Layout Argument: \'{}\'".format(self.layout_type))
+        # # Layout Type (raises KeyError on invalid arguments)
+        self.layout = LAYOUT_TYPES[self.layout_type]()
         self.setLayout(self.layout)
-        # # Layout Alignments:
-        # # # Horizontal
-        if self.h_align == "left":
-            self.layout.setAlignment(QtCore.Qt.AlignLeft)
-        elif self.h_align == "center":
-            self.layout.setAlignment(QtCore.Qt.AlignHCenter)
-        elif self.h_align == "right":
-            self.layout.setAlignment(QtCore.Qt.AlignRight)
-        else:
-            LOG.error("Invalid Horizontal Alignment Argument (\'h_align\'): \'{}\'".format(self.h_align))
-        # # # Vertical
-        if self.v_align == "top":
-            self.layout.setAlignment(QtCore.Qt.AlignTop)
-        elif self.v_align == "center":
-            self.layout.setAlignment(QtCore.Qt.AlignVCenter)
-        elif self.v_align == "bottom":
-            self.layout.setAlignment(QtCore.Qt.AlignBottom)
-        else:
-            LOG.error("Invalid Vertical Alignment Argument (\'v_align\'): \'{}\'".format(self.v_align))
+        # # Layout Alignments (raises KeyError on invalid arguments)
+        # only the vertical flag is applied to the layout: a horizontal alignment shrinks the layout to its size hint,
+        # which would squash rows of buttons (e.g. "New Blendshape" / "Build") to the left
+        self.h_alignment = H_ALIGNMENTS[self.h_align]
+        self.v_alignment = V_ALIGNMENTS[self.v_align]
+        self.layout.setAlignment(self.v_alignment)
         # # Spacing
         self.layout.setSpacing(self.spacing)
         self.layout.setContentsMargins(self.margins)
\ No newline at end of file